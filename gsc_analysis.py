@@ -0,0 +1,87 @@
+import pandas as pd
+
+# === Keyword cannibalization
+# Queries where several of our pages earn impressions compete with themselves.
+# Page x query rows are reduced to per (query, page) sums chunk by chunk, so
+# the analysis can run over streamed or cached data as well as one frame.
+
+KEYS = ["query", "page"]
+COMPACT_EVERY = 8
+
+
+def _reduce(df):
+    df = df.assign(weighted_position=df["position"] * df["impressions"])
+    return df.groupby(KEYS, sort=False, observed=True)[["clicks", "impressions", "weighted_position"]].sum()
+
+
+class CannibalizationAccumulator:
+    def __init__(self):
+        self._parts = []
+
+    def add(self, chunk):
+        self._parts.append(_reduce(chunk[KEYS + ["clicks", "impressions", "position"]]))
+        if len(self._parts) >= COMPACT_EVERY:
+            self._parts = [self._combined()]
+
+    def _combined(self):
+        if not self._parts:
+            return _reduce(pd.DataFrame(columns=KEYS + ["clicks", "impressions", "position"]))
+        if len(self._parts) == 1:
+            return self._parts[0]
+        return pd.concat(self._parts).groupby(level=KEYS, sort=False).sum()
+
+    def result(self, min_pages=2, min_impression_share=0.0):
+        """Return (conflicts, pages). conflicts has one row per query with
+        several competing pages, ranked by lost_clicks: the clicks the query
+        would gain if all of its impressions converted at the CTR of its
+        leading page (the one with the most clicks). pages lists the
+        competing pages of those queries with their shares of the query."""
+        pages = self._combined().reset_index()
+        pages = pages[pages["impressions"] > 0]
+        # Group on integer codes rather than the query strings themselves.
+        pages = pages.assign(query_id=pd.factorize(pages["query"])[0])
+
+        by_query = pages.groupby("query_id", sort=False)
+        query_clicks = by_query["clicks"].transform("sum")
+        query_impressions = by_query["impressions"].transform("sum")
+        pages = pages.assign(
+            position=pages["weighted_position"] / pages["impressions"],
+            ctr=pages["clicks"] / pages["impressions"],
+            click_share=(pages["clicks"] / query_clicks.where(query_clicks > 0)).fillna(0.0),
+            impression_share=pages["impressions"] / query_impressions,
+            query_clicks=query_clicks,
+            query_impressions=query_impressions,
+        ).drop(columns="weighted_position")
+
+        pages = pages[pages["impression_share"] >= min_impression_share]
+        pages = pages[pages.groupby("query_id", sort=False)["page"].transform("size") >= min_pages]
+
+        by_query = pages.groupby("query_id", sort=False)
+        conflicts = by_query.agg(
+            query=("query", "first"),
+            competing_pages=("page", "size"),
+            clicks=("query_clicks", "first"),
+            impressions=("query_impressions", "first"),
+            best_position=("position", "min"),
+            worst_position=("position", "max"),
+        )
+        leaders = pages.loc[by_query["clicks"].idxmax(), ["query_id", "page", "ctr"]].set_index("query_id")
+        conflicts["leading_page"] = leaders["page"]
+        conflicts["position_spread"] = conflicts["worst_position"] - conflicts["best_position"]
+        conflicts["lost_clicks"] = (conflicts["impressions"] * leaders["ctr"] - conflicts["clicks"]).clip(lower=0)
+        conflicts = conflicts.sort_values(["lost_clicks", "impressions"], ascending=False)
+        conflicts.insert(0, "rank", range(1, len(conflicts) + 1))
+
+        pages = pages.assign(rank=pages["query_id"].map(conflicts["rank"]))
+        pages = pages.sort_values(["rank", "clicks", "impressions"], ascending=[True, False, False])
+        conflicts = conflicts.reset_index(drop=True)
+        pages = pages[["rank", "query", "page", "clicks", "impressions", "position", "ctr", "click_share", "impression_share"]]
+        return conflicts, pages.reset_index(drop=True)
+
+
+def find_cannibalization(data, min_pages=2, min_impression_share=0.0):
+    """Run the analysis over a page x query DataFrame or an iterable of chunks."""
+    accumulator = CannibalizationAccumulator()
+    for chunk in [data] if isinstance(data, pd.DataFrame) else data:
+        accumulator.add(chunk)
+    return accumulator.result(min_pages, min_impression_share)
@@ -0,0 +1,564 @@
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future
+from copy import deepcopy
+from datetime import date, timedelta
+
+import google_auth_httplib2
+import httplib2
+import pandas as pd
+
+from gsc_store import store
+
+# === Single-flight fetches
+# Identical requests (same site, dimensions, range, search type, filters and
+# row limit) share one in-flight API call, and a finished result is reused
+# for a short while so colleagues opening the same report don't each burn quota.
+# Only callers with verified access to the property take part: sites().list()
+# also returns properties a user merely added, which the API answers with 403,
+# so those must never be handed someone else's result.
+
+RESULT_TTL_SECONDS = 600
+SHARED_PERMISSIONS = {"siteOwner", "siteFullUser", "siteRestrictedUser"}
+
+_lock = threading.Lock()
+_inflight = {}
+_recent = {}
+
+
+def request_key(query):
+    raw = query.raw
+    filters = sorted(
+        (f["dimension"], f.get("operator", "equals"), f["expression"])
+        for group in raw.get("dimensionFilterGroups", [])
+        for f in group.get("filters", [])
+    )
+    key = {
+        "site": query.api.url,
+        "dimensions": list(raw.get("dimensions", [])),
+        "range": [raw.get("startDate"), raw.get("endDate")],
+        "searchType": raw.get("type", "web"),
+        "dataState": raw.get("dataState", "final"),
+        "filters": filters,
+        "startRow": raw.get("startRow", 0),
+        "limit": query.meta.get("limit"),
+    }
+    return json.dumps(key, sort_keys=True)
+
+
+def _shared_key(query, prefix=""):
+    """request_key(query) with prefix, or None when the caller's result must
+    not be shared with (or served from) other sessions."""
+    if getattr(query.api, "permission", None) not in SHARED_PERMISSIONS:
+        return None
+    return prefix + request_key(query)
+
+
+def _remember(key, value):
+    # Finished results live in the shared dataset store, so the recent cache
+    # counts against its memory budget instead of pinning frames on its own.
+    # Caching is best-effort: if the store can't take the result, the next
+    # identical request simply fetches again.
+    df, extra = value if isinstance(value, tuple) else (value, None)
+    try:
+        handle = store.put(df)
+    except Exception:
+        return
+    with _lock:
+        previous = _recent.get(key)
+        _recent[key] = (time.monotonic(), handle, extra)
+    if previous:
+        store.drop(previous[1])
+
+
+def _lookup_recent(key):
+    now = time.monotonic()
+    for stale in [k for k, (fetched_at, _, _) in _recent.items() if now - fetched_at > RESULT_TTL_SECONDS]:
+        store.drop(_recent.pop(stale)[1])
+    if key not in _recent:
+        return None
+    _, handle, extra = _recent[key]
+    df = store.get(handle)
+    if df is None:
+        del _recent[key]
+        return None
+    return df if extra is None else (df, extra)
+
+
+def _single_flight(key, fetch):
+    if key is None:
+        return fetch()
+    with _lock:
+        value = _lookup_recent(key)
+        if value is not None:
+            return value
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = Future()
+            _inflight[key] = flight
+
+    if leader:
+        try:
+            value = fetch()
+        except BaseException as e:
+            _fail(key, flight, e)
+            raise
+        _finish(key, flight, value)
+
+    return flight.result()
+
+
+def _finish(key, flight, value):
+    # Release followers first; the flight stays registered (already resolved)
+    # until the result is cached so no new caller slips in and refetches.
+    flight.set_result(value)
+    if key is not None:
+        _remember(key, value)
+        with _lock:
+            _inflight.pop(key, None)
+
+
+def _fail(key, flight, error):
+    if key is not None:
+        with _lock:
+            _inflight.pop(key, None)
+    flight.set_exception(error)
+
+
+def fetch_dataframe(query):
+    df = _single_flight(_shared_key(query), lambda: query.get().to_dataframe())
+    # Callers get their own shallow copy so renaming or adding columns can't
+    # leak into the shared result.
+    return df.copy(deep=False)
+
+
+def clear_recent():
+    with _lock:
+        for _, handle, _ in _recent.values():
+            store.drop(handle)
+        _recent.clear()
+
+
+# === Batched fan-outs
+# Per-device / per-country / per-day fan-outs are grouped into batch HTTP
+# requests so many searchanalytics.query calls share one round trip. Any call
+# that fails inside a batch (or a batch the endpoint rejects outright) is
+# retried on its own, with googleapiclient's exponential backoff: those
+# failures are mostly 429s and 5xxs that an immediate retry would hit again.
+
+ROW_LIMIT = 25000
+BATCH_SIZE = 50
+RETRIES = 5
+
+
+def _metrics(search_type):
+    metrics = ["clicks", "impressions", "ctr", "position"]
+    if search_type in ("discover", "googleNews"):
+        metrics.remove("position")
+    return metrics
+
+
+def rows_to_dataframe(rows, dimensions, search_type=None):
+    metrics = _metrics(search_type)
+    records = [tuple(row.get("keys", [])) + tuple(row.get(m) for m in metrics) for row in rows]
+    return pd.DataFrame.from_records(records, columns=list(dimensions) + metrics)
+
+
+def _page_body(body, start_row, cap):
+    page = dict(body)
+    page["startRow"] = start_row
+    page["rowLimit"] = min(ROW_LIMIT, cap - (start_row - body.get("startRow", 0)))
+    return page
+
+
+def execute_batched(service, site_url, bodies, caps=None, batch_size=BATCH_SIZE):
+    """Run searchanalytics.query for every body, paging each one until it is
+    exhausted or hits its row cap. Returns one list of rows per body, in order."""
+    caps = caps or [None] * len(bodies)
+    caps = [cap or float("inf") for cap in caps]
+    rows = [[] for _ in bodies]
+    cursors = [body.get("startRow", 0) for body in bodies]
+    pending = list(range(len(bodies)))
+
+    while pending:
+        pages = {i: _page_body(bodies[i], cursors[i], caps[i]) for i in pending}
+        responses = {}
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            failed = []
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    responses[int(request_id)] = response
+                else:
+                    failed.append(int(request_id))
+
+            if len(chunk) > 1:
+                batch = service.new_batch_http_request(callback=callback)
+                for i in chunk:
+                    batch.add(service.searchanalytics().query(siteUrl=site_url, body=pages[i]), request_id=str(i))
+                try:
+                    batch.execute()
+                except Exception:
+                    failed = [i for i in chunk if i not in responses]
+            else:
+                failed = chunk
+
+            for i in failed:
+                responses[i] = service.searchanalytics().query(siteUrl=site_url, body=pages[i]).execute(num_retries=RETRIES)
+
+        still_pending = []
+        for i in pending:
+            page_rows = responses[i].get("rows", [])
+            rows[i].extend(page_rows)
+            cursors[i] += len(page_rows)
+            if len(page_rows) == pages[i]["rowLimit"] and len(rows[i]) < caps[i]:
+                still_pending.append(i)
+        pending = still_pending
+
+    return rows
+
+
+def fetch_many(queries, batch_size=BATCH_SIZE):
+    """Fetch a list of searchconsole queries as one batched fan-out and return
+    a DataFrame per query. Results already in the recent cache are reused."""
+    results = [None] * len(queries)
+    keys = [_shared_key(query) for query in queries]
+
+    with _lock:
+        for n, key in enumerate(keys):
+            df = _lookup_recent(key) if key is not None else None
+            if df is not None:
+                results[n] = df.copy(deep=False)
+
+    by_site = {}
+    for n, query in enumerate(queries):
+        if results[n] is None:
+            by_site.setdefault(query.api.url, []).append(n)
+
+    for site_url, indexes in by_site.items():
+        service = queries[indexes[0]].api.account.service
+        bodies = [queries[n].build() for n in indexes]
+        caps = [queries[n].meta.get("limit") for n in indexes]
+        fetched = execute_batched(service, site_url, bodies, caps, batch_size)
+        for n, body, site_rows in zip(indexes, bodies, fetched):
+            df = rows_to_dataframe(site_rows, body.get("dimensions", []), body.get("type"))
+            if keys[n] is not None:
+                _remember(keys[n], df)
+            results[n] = df.copy(deep=False)
+
+    return results
+
+
+# === Exhaustive fetches
+# A response that fills its row cap is silently truncated. Such a piece is
+# split into disjoint sub-requests (by date, then device, then country, then
+# page prefix) and refetched until every piece fits, batching each round of
+# pieces together. Pieces that can't be split any further are reported.
+
+DEVICES = ["DESKTOP", "MOBILE", "TABLET"]
+MAX_PIECES = 2000
+
+
+def _with_filters(body, *filters):
+    child = deepcopy(body)
+    child.setdefault("dimensionFilterGroups", []).append({
+        "groupType": "and",
+        "filters": [{"dimension": d, "operator": op, "expression": e} for d, op, e in filters],
+    })
+    return child
+
+
+def _has_equals_filter(body, dimension):
+    return any(
+        f["dimension"] == dimension and f.get("operator", "equals") == "equals"
+        for group in body.get("dimensionFilterGroups", [])
+        for f in group.get("filters", [])
+    )
+
+
+def _child_prefixes(pages, prefix):
+    # Descend while every sampled page sits under one child, so a property's
+    # scheme and host (or a single dominant folder) don't cost a round each.
+    while True:
+        rests = [page[len(prefix):] for page in pages if len(page) > len(prefix)]
+        leaves = len(rests) < len(pages)
+        if not rests:
+            return prefix, []
+        if any("/" in rest for rest in rests):
+            children = sorted({prefix + rest[:rest.index("/") + 1] for rest in rests if "/" in rest})
+            leaves = leaves or any("/" not in rest for rest in rests)
+        else:
+            children = sorted({prefix + rest[0] for rest in rests})
+        if len(children) > 1 or leaves:
+            return prefix, children
+        prefix = children[0]
+
+
+def _split(body, prefix, rows, dimensions):
+    """Return disjoint (body, page prefix) pieces covering body, or [] when it
+    can't be narrowed any further."""
+    start, end = date.fromisoformat(body["startDate"]), date.fromisoformat(body["endDate"])
+    if start < end:
+        mid = start + (end - start) // 2
+        first, second = deepcopy(body), deepcopy(body)
+        first["endDate"] = mid.isoformat()
+        second["startDate"] = (mid + timedelta(days=1)).isoformat()
+        return [(first, prefix), (second, prefix)]
+
+    if not _has_equals_filter(body, "device"):
+        return [(_with_filters(body, ("device", "equals", device)), prefix) for device in DEVICES]
+
+    if "country" in dimensions and not _has_equals_filter(body, "country"):
+        position = dimensions.index("country")
+        countries = sorted({row["keys"][position] for row in rows})
+        pieces = [(_with_filters(body, ("country", "equals", c)), prefix) for c in countries]
+        pieces.append((_with_filters(body, *[("country", "notEquals", c) for c in countries]), prefix))
+        return pieces
+
+    if "page" in dimensions:
+        position = dimensions.index("page")
+        pages = [row["keys"][position] for row in rows]
+        narrowed, children = _child_prefixes(pages, prefix)
+        if not children and narrowed == prefix:
+            return []
+        children = children or [narrowed]
+        pieces = [(_with_filters(body, ("page", "includingRegex", "^" + re.escape(c))), c) for c in children]
+        remainder = "^(" + "|".join(re.escape(c) for c in children) + ")"
+        pieces.append((_with_filters(body, ("page", "excludingRegex", remainder)), prefix))
+        return pieces
+
+    return []
+
+
+def _merge(row_lists, dimensions, search_type):
+    if not row_lists:
+        return rows_to_dataframe([], dimensions, search_type)
+    frames = []
+    for rows in row_lists:
+        # Deduplicate within a piece (overlapping pages) before combining pieces.
+        unique = {tuple(row.get("keys", [])): row for row in rows}
+        frames.append(rows_to_dataframe(list(unique.values()), dimensions, search_type))
+    df = pd.concat(frames, ignore_index=True)
+
+    if not dimensions or not df.duplicated(dimensions).any():
+        return df
+
+    # Pieces split on something that isn't a dimension (date halves, devices)
+    # return the same keys more than once; recombine their metrics.
+    df = df.assign(weighted=df["position"] * df["impressions"]) if "position" in df else df
+    sums = ["clicks", "impressions"] + (["weighted"] if "weighted" in df else [])
+    merged = df.groupby(dimensions, as_index=False, sort=False)[sums].sum()
+    merged["ctr"] = merged["clicks"] / merged["impressions"].where(merged["impressions"] > 0)
+    merged["ctr"] = merged["ctr"].fillna(0.0)
+    if "weighted" in merged:
+        merged["position"] = merged.pop("weighted") / merged["impressions"].where(merged["impressions"] > 0)
+    return merged[list(dimensions) + _metrics(search_type)]
+
+
+def _fetch_exhaustive(query, piece_cap, batch_size):
+    service = query.api.account.service
+    site_url = query.api.url
+    root = query.build()
+    root.pop("startRow", None)
+    root.pop("rowLimit", None)
+    dimensions = root.get("dimensions", [])
+    totals_body = {k: v for k, v in root.items() if k != "dimensions"}
+
+    # Each piece carries its parent's (truncated) rows, which stand in for it
+    # if the request budget runs out before the piece is fetched.
+    pieces = [(root, "", None)]
+    finished, truncated = [], []
+    fetched = 0
+    total_clicks = None
+
+    while pieces:
+        if fetched + len(pieces) > MAX_PIECES:
+            # Siblings are always queued together, so every unfetched piece's
+            # parent is replaced by its truncated rows as a whole.
+            parents = {id(rows): rows for _, _, rows in pieces if rows is not None}
+            finished.extend(parents.values())
+            truncated.extend(parents.values())
+            break
+        bodies = [body for body, _, _ in pieces]
+        caps = [piece_cap] * len(pieces)
+        if total_clicks is None:
+            bodies.append(totals_body)
+            caps.append(1)
+        results = execute_batched(service, site_url, bodies, caps, batch_size)
+        if total_clicks is None:
+            totals = results.pop()
+            total_clicks = totals[0]["clicks"] if totals else 0
+        fetched += len(pieces)
+
+        next_pieces = []
+        for (body, prefix, _), rows in zip(pieces, results):
+            if len(rows) >= piece_cap:
+                children = _split(body, prefix, rows, dimensions)
+                if children:
+                    next_pieces.extend((child, child_prefix, rows) for child, child_prefix in children)
+                    continue
+                truncated.append(body)
+            finished.append(rows)
+        pieces = next_pieces
+
+    df = _merge(finished, dimensions, root.get("type"))
+    completeness = {
+        "pieces": fetched,
+        "truncated_pieces": len(truncated),
+        "complete": not truncated,
+        "rows": len(df),
+        # Share of the property's clicks (for the same range and filters) that
+        # the rows account for. Anonymized queries keep this below 1 for
+        # query-level reports even when nothing was truncated.
+        "clicks_coverage": float(df["clicks"].sum()) / total_clicks if total_clicks else None,
+    }
+    return df, completeness
+
+
+def fetch_exhaustive(query, piece_cap=ROW_LIMIT, batch_size=BATCH_SIZE):
+    """Fetch every row for query, splitting truncated responses until each
+    piece fits under piece_cap. Returns (DataFrame, completeness dict)."""
+    key = _shared_key(query, "exhaustive:%d:" % piece_cap)
+    df, completeness = _single_flight(key, lambda: _fetch_exhaustive(query, piece_cap, batch_size))
+    return df.copy(deep=False), dict(completeness)
+
+
+# === Progressive fetches
+# Interactive views first get a small, recent top-rows sample (one quick call),
+# then running totals and a top-rows head as the full result's pages arrive
+# from a background thread. The full fetch is an ordinary single-flight
+# leader: other sessions asking for the same report follow its pages, and the
+# finished result lands in the recent cache even if the viewer navigates away
+# before it completes.
+
+PREVIEW_ROWS = 1000
+PREVIEW_DAYS = 7
+HEAD_ROWS = 50
+
+_feeds = {}
+
+
+class _PageFeed:
+    def __init__(self):
+        self._pages = []
+        self._done = False
+        self._cond = threading.Condition()
+
+    def put(self, frame):
+        with self._cond:
+            self._pages.append(frame)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def __iter__(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self._pages) and not self._done:
+                    self._cond.wait()
+                if position >= len(self._pages):
+                    return
+                frame = self._pages[position]
+            position += 1
+            yield frame
+
+
+def _fetch_pages(query, key, flight, feed):
+    try:
+        # httplib2 connections aren't thread-safe, so the background fetch
+        # gets its own instead of sharing the session's service connection.
+        http = google_auth_httplib2.AuthorizedHttp(query.api.account.credentials, http=httplib2.Http())
+        service = query.api.account.service
+        body = query.build()
+        limit = query.meta.get("limit", float("inf"))
+        frames, fetched = [], 0
+        while fetched < limit:
+            page = _page_body(body, body.get("startRow", 0) + fetched, limit)
+            rows = service.searchanalytics().query(siteUrl=query.api.url, body=page).execute(http=http, num_retries=RETRIES).get("rows", [])
+            if not rows:
+                break
+            frames.append(rows_to_dataframe(rows, body.get("dimensions", []), body.get("type")))
+            feed.put(frames[-1])
+            fetched += len(rows)
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+        else:
+            df = rows_to_dataframe([], body.get("dimensions", []), body.get("type"))
+    except BaseException as e:
+        feed.close()
+        with _lock:
+            _feeds.pop(key, None)
+        _fail(key, flight, e)
+        return
+    feed.close()
+    with _lock:
+        _feeds.pop(key, None)
+    _finish(key, flight, df)
+
+
+def _totals(df):
+    if df.empty:
+        return {"clicks": 0, "impressions": 0, "rows": 0}
+    return {"clicks": int(df["clicks"].sum()), "impressions": int(df["impressions"].sum()), "rows": len(df)}
+
+
+def _head(df, rows):
+    return df.sort_values("clicks", ascending=False, kind="stable").head(rows) if not df.empty else df
+
+
+def fetch_progressive(query, transform=None, head_rows=HEAD_ROWS, preview_rows=PREVIEW_ROWS, preview_days=PREVIEW_DAYS):
+    """Yield (frame, totals, stage) triples. For "preview" (top rows of the
+    last preview_days) and "partial" (full range, pages so far), frame is the
+    head_rows rows with the most clicks and totals the clicks, impressions and
+    rows so far, both after transform (e.g. the app's filters), which only
+    ever sees each page once. For "final", frame is the full untransformed
+    result and totals is None."""
+    key = _shared_key(query)
+    leader = False
+    with _lock:
+        df = _lookup_recent(key) if key is not None else None
+        flight = feed = None
+        if key is None:
+            # Private fetch: same pipeline, nothing registered or cached.
+            flight, feed = Future(), _PageFeed()
+            leader = True
+        elif df is None:
+            flight, feed = _inflight.get(key), _feeds.get(key)
+            if flight is None:
+                flight, feed = Future(), _PageFeed()
+                _inflight[key], _feeds[key] = flight, feed
+                leader = True
+    if df is not None:
+        yield df.copy(deep=False), None, "final"
+        return
+    if leader:
+        threading.Thread(target=_fetch_pages, args=(query, key, flight, feed), daemon=True).start()
+
+    def prepare(frame):
+        return transform(frame) if transform is not None and not frame.empty else frame
+
+    start, end = query.raw["startDate"], query.raw["endDate"]
+    preview_start = max(date.fromisoformat(start), date.fromisoformat(end) - timedelta(days=preview_days - 1))
+    preview = prepare(fetch_dataframe(query.range(preview_start.isoformat(), end).limit(preview_rows)))
+    yield _head(preview, head_rows), _totals(preview), "preview"
+
+    # A plain fetch_dataframe leader has no page feed; just wait for its result.
+    if feed is not None:
+        head, totals = None, {"clicks": 0, "impressions": 0, "rows": 0}
+        for page in feed:
+            page = prepare(page)
+            for name, value in _totals(page).items():
+                totals[name] += value
+            head = _head(page if head is None else pd.concat([head, _head(page, head_rows)], ignore_index=True), head_rows)
+            yield head, dict(totals), "partial"
+
+    yield flight.result().copy(deep=False), None, "final"
@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from st_aggrid import AgGrid, GridOptionsBuilder
+
+from gsc_store import store
+
+# === Server-paginated results grid
+# Sorting, filtering and paging run here on the server against cached row
+# orders and filter masks; only the visible page is serialized to the browser,
+# so multi-million row results stay responsive. The grid and the CSV download
+# only ever hold a dataset store handle: Streamlit keeps fragment arguments and
+# download callables for the whole session, and a frame kept there would stay
+# in memory even after the store has spilled or evicted it.
+
+PAGE_SIZES = [25, 50, 100, 250]
+CACHE_BUDGET_BYTES = 256 * 1024 * 1024
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+def _cached(cache_key, build):
+    with _lock:
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            return _cache[cache_key]
+    value = build()
+    with _lock:
+        _cache[cache_key] = value
+        used = sum(cached.nbytes for cached in _cache.values())
+        while used > CACHE_BUDGET_BYTES and len(_cache) > 1:
+            used -= _cache.popitem(last=False)[1].nbytes
+    return value
+
+
+def _sort_order(df, dataset_key, column, ascending):
+    def build():
+        values = df[column].reset_index(drop=True)
+        return np.asarray(values.sort_values(ascending=ascending, kind="stable", na_position="last").index)
+    return _cached(("sort", dataset_key, column, ascending), build)
+
+
+def _filter_mask(df, dataset_key, column, text):
+    def build():
+        return df[column].str.contains(text, case=False, regex=False, na=False).to_numpy(dtype=bool)
+    return _cached(("filter", dataset_key, column, text), build)
+
+
+def _view(df, dataset_key, sort_column, ascending, filter_column, filter_text):
+    def build():
+        if sort_column:
+            positions = _sort_order(df, dataset_key, sort_column, ascending)
+        else:
+            positions = np.arange(len(df))
+        if filter_column and filter_text:
+            positions = positions[_filter_mask(df, dataset_key, filter_column, filter_text)[positions]]
+        return positions
+    return _cached(("view", dataset_key, sort_column, ascending, filter_column, filter_text), build)
+
+
+@st.fragment
+def results_grid(handle, key):
+    """Render the dataset behind a store handle as a paginated grid. Cached
+    sort orders and filters are keyed by the handle, so they are reused
+    across reruns. Runs as a fragment: paging, sorting and filtering rerun
+    only the grid, not the rest of the page."""
+    df = store.get(handle)
+    if df is None:
+        st.info("ℹ️ These results have expired from the cache. Please fetch the data again.")
+        return
+    dataset_key = handle
+    text_columns = [c for c in df.columns if pd.api.types.is_string_dtype(df[c])]
+    sortable_columns = [
+        c for c in df.columns
+        if c in text_columns or pd.api.types.is_numeric_dtype(df[c]) or pd.api.types.is_datetime64_any_dtype(df[c])
+    ]
+
+    col1, col2, col3, col4 = st.columns([2, 1, 2, 2])
+    with col1:
+        sort_column = st.selectbox("Sort by", ["(none)"] + sortable_columns, key=f"{key}_sort")
+    with col2:
+        descending = st.checkbox("Descending", value=True, key=f"{key}_desc")
+    with col3:
+        filter_column = st.selectbox("Filter column", ["(none)"] + text_columns, key=f"{key}_filter_col")
+    with col4:
+        filter_text = st.text_input("Contains", key=f"{key}_filter_text")
+
+    sort_column = None if sort_column == "(none)" else sort_column
+    filter_column = None if filter_column == "(none)" else filter_column
+    filter_text = filter_text.strip()
+    positions = _view(df, dataset_key, sort_column, not descending, filter_column, filter_text)
+
+    # Go back to the first page whenever the data, sort or filter changes.
+    signature = (dataset_key, sort_column, descending, filter_column, filter_text)
+    if st.session_state.get(f"{key}_signature") != signature:
+        st.session_state[f"{key}_signature"] = signature
+        st.session_state[f"{key}_page"] = 1
+
+    col5, col6 = st.columns([1, 3])
+    with col5:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_page_size")
+    pages = max(1, -(-len(positions) // page_size))
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with col6:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+
+    start = (page - 1) * page_size
+    window = df.iloc[positions[start:start + page_size]].reset_index(drop=True)
+    first_row = start + 1 if len(window) else 0
+    st.caption(f"Page {page:,} of {pages:,}: rows {first_row:,}–{start + len(window):,} of {len(positions):,} (filtered from {len(df):,})")
+
+    builder = GridOptionsBuilder.from_dataframe(window)
+    builder.configure_default_column(sortable=False, filter=False, resizable=True)
+    AgGrid(
+        window,
+        gridOptions=builder.build(),
+        height=min(600, 60 + 30 * max(len(window), 1)),
+        key=f"{key}_grid_{hash(signature)}_{start}_{page_size}",
+    )
+
+
+def download_csv(handle, file_name, label="📥 Download CSV"):
+    """Download button for the dataset behind a store handle. The CSV is
+    built when the button is clicked, not on every rerun."""
+    def build():
+        df = store.get(handle)
+        return "" if df is None else df.to_csv(index=False)
+    st.download_button(label, build, file_name, "text/csv")
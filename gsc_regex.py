@@ -0,0 +1,100 @@
+import multiprocessing
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import re2
+except ImportError:  # google-re2 not installed: every pattern takes the time-boxed path
+    re2 = None
+
+# === Regex filters on user input
+# Patterns typed into the page/query filters run on RE2 (linear time, no
+# catastrophic backtracking). Patterns RE2 can't handle (backreferences,
+# lookarounds) fall back to Python's re in a child process that is killed
+# once it exceeds the time budget, so a bad pattern can't pin a worker.
+
+TIME_BUDGET_SECONDS = 2.0
+
+
+class RegexTimeout(Exception):
+    pass
+
+
+def _re2_matcher(pattern, search):
+    if re2 is None:
+        return None
+    options = re2.Options()
+    options.log_errors = False  # unsupported patterns are expected; don't spam stderr
+    try:
+        compiled = re2.compile(pattern, options)
+    except re2.error:
+        return None
+    return compiled.search if search else compiled.match
+
+
+def _match_worker(conn, pattern, values, search):
+    compiled = re.compile(pattern)
+    test = compiled.search if search else compiled.match
+    conn.send_bytes(bytes(test(value) is not None for value in values))
+    conn.close()
+
+
+def _match_with_budget(pattern, values, search, budget):
+    re.compile(pattern)  # surface re.error here rather than in the child
+
+    # Never fork the (multi-threaded) Streamlit server itself: workers come
+    # from a single-threaded fork server where there is one, else are spawned.
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    receiver, sender = ctx.Pipe(duplex=False)
+    worker = ctx.Process(target=_match_worker, args=(sender, pattern, values, search), daemon=True)
+    worker.start()
+    sender.close()
+    try:
+        if not receiver.poll(budget):
+            raise RegexTimeout(f"Pattern {pattern!r} took longer than {budget:g}s")
+        result = receiver.recv_bytes()
+    except EOFError:
+        raise RegexTimeout(f"Pattern {pattern!r} could not be evaluated")
+    finally:
+        if worker.is_alive():
+            worker.terminate()
+        worker.join()
+        receiver.close()
+    return np.frombuffer(result, dtype=bool)
+
+
+def regex_mask(series, pattern, search=False, case=True, budget=TIME_BUDGET_SECONDS):
+    """Boolean mask of the values in series matching pattern, anchored at the
+    start like str.match (or anywhere, like str.contains, with search=True).
+    Missing values never match. Raises re.error for invalid patterns and
+    RegexTimeout when a fallback evaluation runs out of time."""
+    if not case:
+        pattern = "(?i)" + pattern
+
+    # Page x query frames repeat each page (and query) many times over; only
+    # evaluate each distinct value once.
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    values = [value if isinstance(value, str) else "" for value in uniques]
+
+    matcher = _re2_matcher(pattern, search)
+    if matcher is not None:
+        unique_mask = np.fromiter((matcher(value) is not None for value in values), dtype=bool, count=len(values))
+    else:
+        unique_mask = _match_with_budget(pattern, values, search, budget)
+    unique_mask = unique_mask & np.array([isinstance(value, str) for value in uniques], dtype=bool)
+
+    mask = np.zeros(len(series), dtype=bool)
+    present = codes >= 0
+    mask[present] = unique_mask[codes[present]]
+    return pd.Series(mask, index=series.index)
+
+
+def safe_regex_match(series, pattern, invert=False, search=False, case=True):
+    try:
+        matched = regex_mask(series, pattern, search=search, case=case)
+    except (re.error, RegexTimeout):
+        return pd.Series(False, index=series.index)
+    return ~matched if invert else matched
@@ -0,0 +1,207 @@
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+
+# === Shared dataset store
+# Sessions keep a handle in st.session_state instead of their own copy of the
+# data. The store holds datasets in memory up to a process-wide budget; the
+# least recently used ones are spilled to Arrow IPC files and reloaded
+# memory-mapped (the OS pages them in, nothing is copied onto the heap).
+# Spill files are themselves evicted once the disk budget is exceeded.
+# Putting a frame that shares its memory with one already held (e.g. a shallow
+# copy of a cached result) returns a new handle on the same dataset, so the
+# data is held and counted once.
+
+MEMORY_BUDGET_BYTES = int(os.environ.get("GSC_STORE_MEMORY_MB", "512")) * 1024 * 1024
+DISK_BUDGET_BYTES = int(os.environ.get("GSC_STORE_DISK_MB", "4096")) * 1024 * 1024
+# Cloud Run's /tmp is backed by memory; point this at a mounted volume there.
+SPILL_DIR = os.environ.get("GSC_STORE_SPILL_DIR")
+
+
+def _location(values):
+    # Where an array's data lives, without copying it; None if that can't be told.
+    dtype = values.dtype
+    if isinstance(dtype, pd.ArrowDtype) or (isinstance(dtype, pd.StringDtype) and dtype.storage == "pyarrow"):
+        chunks = values.array.__arrow_array__().chunks
+        return str(dtype), tuple(
+            (chunk.offset, len(chunk), tuple(buf.address if buf is not None else 0 for buf in chunk.buffers()))
+            for chunk in chunks
+        )
+    if pd.api.types.is_extension_array_dtype(dtype):
+        return None
+    array = values.to_numpy(copy=False)
+    return str(dtype), array.__array_interface__["data"][0], array.strides
+
+
+def _buffer_key(df):
+    """Identify the memory behind df's columns and index. Shallow copies of a
+    frame share it; None when some column can't be located without a copy."""
+    if isinstance(df.index, pd.RangeIndex):
+        index = (df.index.start, df.index.stop, df.index.step)
+    else:
+        index = _location(df.index)
+    key = [len(df), index]
+    for name, column in df.items():
+        key.append((name, _location(column)))
+    if any(part is None for part in key):
+        return None
+    return tuple(key)
+
+
+class DatasetStore:
+    def __init__(self, memory_budget=MEMORY_BUDGET_BYTES, disk_budget=DISK_BUDGET_BYTES, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.spill_dir = spill_dir or SPILL_DIR or tempfile.mkdtemp(prefix="gsc-store-")
+        self._lock = threading.Lock()
+        # Datasets are keyed by an entry id; handles point at entries, and an
+        # entry goes away once its last handle is dropped.
+        self._memory = OrderedDict()
+        self._spilled = OrderedDict()
+        self._spilling = set()
+        self._handles = {}
+        self._refs = {}
+        # Buffer keys of the entries held in memory. Only those: their buffers
+        # stay alive, so their addresses can't be reused by unrelated data.
+        self._by_buffers = {}
+        self._buffer_keys = {}
+
+    def put(self, df):
+        handle = uuid.uuid4().hex
+        buffer_key = _buffer_key(df)
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        victims = []
+        with self._lock:
+            entry = self._by_buffers.get(buffer_key) if buffer_key else None
+            if entry is not None:
+                self._memory.move_to_end(entry)
+            else:
+                entry = handle
+                self._memory[entry] = (df, nbytes)
+                if buffer_key:
+                    self._by_buffers[buffer_key] = entry
+                    self._buffer_keys[entry] = buffer_key
+                victims = self._pick_victims()
+            self._handles[handle] = entry
+            self._refs[entry] = self._refs.get(entry, 0) + 1
+        self._evict(victims)
+        return handle
+
+    def get(self, handle):
+        """Return the dataset for handle, or None if it has been evicted from
+        disk too (or dropped)."""
+        with self._lock:
+            entry = self._handles.get(handle)
+            if entry in self._memory:
+                self._memory.move_to_end(entry)
+                return self._memory[entry][0]
+            if entry in self._spilled:
+                self._spilled.move_to_end(entry)
+                path = self._spilled[entry][0]
+            else:
+                self._release(handle)
+                return None
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    def drop(self, handle):
+        with self._lock:
+            spilled = self._release(handle)
+        if spilled:
+            self._remove(spilled[0])
+
+    def _release(self, handle):
+        # Called with the lock held. Returns the entry's spill record once its
+        # last handle is gone, for the caller to delete outside the lock.
+        entry = self._handles.pop(handle, None)
+        if entry is None:
+            return None
+        self._refs[entry] -= 1
+        if self._refs[entry]:
+            return None
+        del self._refs[entry]
+        self._forget_buffers(entry)
+        self._memory.pop(entry, None)
+        return self._spilled.pop(entry, None)
+
+    def _forget_buffers(self, entry):
+        buffer_key = self._buffer_keys.pop(entry, None)
+        if buffer_key is not None:
+            del self._by_buffers[buffer_key]
+
+    def memory_usage(self):
+        with self._lock:
+            return sum(nbytes for _, nbytes in self._memory.values())
+
+    def _pick_victims(self):
+        # Least recently used datasets to spill until memory fits the budget.
+        # They stay readable from memory while they're being written.
+        used = sum(nbytes for entry, (_, nbytes) in self._memory.items() if entry not in self._spilling)
+        victims = []
+        for entry, (df, nbytes) in self._memory.items():
+            if used <= self.memory_budget:
+                break
+            if entry in self._spilling:
+                continue
+            self._spilling.add(entry)
+            victims.append((entry, df))
+            used -= nbytes
+        return victims
+
+    def _evict(self, victims):
+        # Arrow files are written without holding the lock, so lookups from
+        # other sessions never wait behind a large spill.
+        for entry, df in victims:
+            try:
+                spilled = self._spill(entry, df)
+            except Exception:
+                # Keep the dataset in memory (over budget) rather than lose it.
+                with self._lock:
+                    self._spilling.discard(entry)
+                continue
+            with self._lock:
+                self._spilling.discard(entry)
+                if self._memory.pop(entry, None) is None:
+                    dropped = True
+                else:
+                    self._forget_buffers(entry)
+                    self._spilled[entry] = spilled
+                    dropped = False
+            if dropped:
+                self._remove(spilled[0])
+
+        with self._lock:
+            expired = []
+            on_disk = sum(nbytes for _, nbytes in self._spilled.values())
+            while on_disk > self.disk_budget and self._spilled:
+                _, (path, nbytes) = self._spilled.popitem(last=False)
+                expired.append(path)
+                on_disk -= nbytes
+        for path in expired:
+            self._remove(path)
+
+    def _spill(self, entry, df):
+        path = os.path.join(self.spill_dir, entry + ".arrow")
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        except BaseException:
+            self._remove(path)
+            raise
+        return path, os.path.getsize(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+store = DatasetStore()
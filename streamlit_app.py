@@ -1,10 +1,13 @@
 import streamlit as st
-import pandas as pd
 import searchconsole
+from gsc_fetch import PREVIEW_DAYS, fetch_dataframe, fetch_progressive
+from gsc_store import store
+from gsc_regex import safe_regex_match
+from gsc_analysis import find_cannibalization
+from gsc_grid import download_csv, results_grid
 from google_auth_oauthlib.flow import Flow
 from apiclient.discovery import build
 from openai import OpenAI
-import re
 from datetime import date, timedelta
 import requests
 import json
@@ -20,19 +23,12 @@ if "webhook_url" not in st.session_state:
     st.session_state["webhook_url"] = ""
 
 # Helper functions
-def safe_regex_match(series, pattern, invert=False):
-    try:
-        matched = series.str.match(pattern)
-        return ~matched if invert else matched
-    except re.error:
-        return pd.Series([False] * len(series))
-
 def apply_page_filter(df, filter_type, filter_value):
     values = [v.strip() for v in filter_value.split(",") if v.strip()]
     if not values:
         return df
     if filter_type == "contains":
-        return df[df["page"].str.contains('|'.join(values), case=False, na=False)]
+        return df[safe_regex_match(df["page"], '|'.join(values), search=True, case=False)]
     elif filter_type == "starts with":
         return df[df["page"].str.startswith(tuple(values))]
     elif filter_type == "ends with":
@@ -48,7 +44,7 @@ def apply_query_filter(df, filter_type, filter_value):
     if not values:
         return df
     if filter_type == "contains":
-        return df[df["query"].str.contains('|'.join(values), case=False, na=False)]
+        return df[safe_regex_match(df["query"], '|'.join(values), search=True, case=False)]
     elif filter_type == "starts with":
         return df[df["query"].str.startswith(tuple(values))]
     elif filter_type == "ends with":
@@ -126,6 +122,7 @@ if "account" in st.session_state:
         with st.form("gsc_form"):
             selected_site = st.selectbox("🌐 Select GSC Property", site_urls)
             timescale = st.selectbox("Date range", ["Last 7 days", "Last 28 days", "Last 3 months", "Last 12 months"])
+            progressive = st.checkbox("⚡ Progressive preview", value=True, help="Show a quick sample of recent top rows first, then refine as the full data arrives.")
             submit_gsc = st.form_submit_button("📊 Fetch GSC Data")
 
         if submit_gsc:
@@ -133,14 +130,39 @@ if "account" in st.session_state:
             days = days_map[timescale]
             end_date = date.today()
             start_date = end_date + timedelta(days=days)
+            webproperty = st.session_state["account"][selected_site]
+            query = webproperty.query.range(start_date.isoformat(), end_date.isoformat()).dimension("page", "query")
+
+            if progressive:
+                stage_labels = {
+                    "preview": f"🟡 Partial: preview of the top rows from the last {PREVIEW_DAYS} days. Loading the full range...",
+                    "partial": "🟡 Partial: {rows:,} rows loaded so far. Still loading...",
+                }
+                status = st.empty()
+                stats = st.empty()
+                table = st.empty()
+
+                def apply_filters(frame):
+                    frame = apply_page_filter(frame, page_filter_type, page_filter_value)
+                    return apply_query_filter(frame, query_filter_type, query_filter_value)
+
+                for df, totals, stage in fetch_progressive(query, transform=apply_filters):
+                    if stage == "final":
+                        break
+                    status.info(stage_labels[stage].format(rows=totals["rows"]))
+                    with stats.container():
+                        col1, col2, col3 = st.columns(3)
+                        col1.metric("Clicks (partial)", f"{totals['clicks']:,}")
+                        col2.metric("Impressions (partial)", f"{totals['impressions']:,}")
+                        col3.metric("Rows (partial)", f"{totals['rows']:,}")
+                    table.dataframe(df)
+                status.empty()
+                stats.empty()
+                table.empty()
+
             with st.spinner("Fetching from Google Search Console..."):
-                webproperty = st.session_state["account"][selected_site]
-                df = (
-                    webproperty.query.range(start_date.isoformat(), end_date.isoformat())
-                    .dimension("page", "query")
-                    .get()
-                    .to_dataframe()
-                )
+                if not progressive:
+                    df = fetch_dataframe(query)
                 df = apply_page_filter(df, page_filter_type, page_filter_value)
                 df = apply_query_filter(df, query_filter_type, query_filter_value)
 
@@ -148,16 +170,40 @@ if "account" in st.session_state:
                     st.warning("No data returned. Adjust your filters.")
                     st.stop()
 
-                st.session_state["gsc_data"] = df
+                if "gsc_data_handle" in st.session_state:
+                    store.drop(st.session_state["gsc_data_handle"])
+                st.session_state["gsc_data_handle"] = store.put(df)
                 st.success("✅ Data fetched!")
 
 # Show data + webhook after fetch
-if "gsc_data" in st.session_state:
-    df = st.session_state["gsc_data"]
+if "gsc_data_handle" in st.session_state:
+    df = store.get(st.session_state["gsc_data_handle"])
+    if df is None:
+        del st.session_state["gsc_data_handle"]
+        st.info("ℹ️ These results have expired from the cache. Please fetch the data again.")
+        st.stop()
     st.markdown("### 📊 Preview Data")
-    st.dataframe(df.head(50))
-    csv = df.to_csv(index=False)
-    st.download_button("📥 Download CSV", csv, "output.csv", "text/csv")
+    st.caption("🟢 Final: complete results for the selected range.")
+    results_grid(st.session_state["gsc_data_handle"], "results")
+    download_csv(st.session_state["gsc_data_handle"], "output.csv")
+
+    # Keyword cannibalization
+    st.markdown("### 🥊 Keyword Cannibalization")
+    if st.button("🔍 Find Competing Pages"):
+        with st.spinner("Looking for queries where several pages compete..."):
+            conflicts, competing_pages = find_cannibalization(df)
+        if conflicts.empty:
+            st.info("ℹ️ No queries with several competing pages.")
+        else:
+            st.write(f"{len(conflicts):,} queries have several competing pages, ranked by clicks lost to the split:")
+            st.dataframe(conflicts.head(100))
+            st.dataframe(competing_pages[competing_pages["rank"] <= 100])
+            st.download_button(
+                "📥 Download Cannibalization CSV",
+                competing_pages.to_csv(index=False),
+                "cannibalization.csv",
+                "text/csv",
+            )
 
     # Webhook section (persistent)
     st.markdown("### 🔄 Send Data to n8n Webhook")
@@ -3,6 +3,9 @@ import streamlit as st
 import pandas as pd
 import openai
 import searchconsole
+from gsc_fetch import fetch_dataframe
+from gsc_store import store
+from gsc_grid import download_csv, results_grid
 from google_auth_oauthlib.flow import Flow
 from apiclient import discovery
 from datetime import datetime, timedelta
@@ -82,7 +85,7 @@ if st.button("📊 Fetch Top Queries"):
         if page_filter.strip():
             q = q.filter("page", page_filter.strip(), "contains")
 
-        df = q.get().to_dataframe()
+        df = fetch_dataframe(q)
 
         if df.empty:
             st.warning("No data found.")
@@ -95,8 +98,18 @@ if st.button("📊 Fetch Top Queries"):
             .rename(columns={0: "top_10_queries"})
         )
 
-        st.subheader("📄 Top 10 Queries per Page")
-        st.dataframe(top_queries)
+        if "top_queries_handle" in st.session_state:
+            store.drop(st.session_state["top_queries_handle"])
+        st.session_state["top_queries_handle"] = store.put(top_queries)
 
-        csv = top_queries.to_csv(index=False)
-        st.download_button("📥 Download CSV", csv, "top_queries.csv", "text/csv")
+# === Results (kept across reruns so the grid can page, sort and filter)
+if "top_queries_handle" in st.session_state:
+    if store.get(st.session_state["top_queries_handle"]) is None:
+        del st.session_state["top_queries_handle"]
+        st.info("ℹ️ These results have expired from the cache. Please fetch the data again.")
+        st.stop()
+
+    st.subheader("📄 Top 10 Queries per Page")
+    results_grid(st.session_state["top_queries_handle"], "top_queries")
+
+    download_csv(st.session_state["top_queries_handle"], "top_queries.csv")
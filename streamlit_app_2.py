@@ -2,6 +2,9 @@
 import streamlit as st
 import pandas as pd
 import searchconsole
+from gsc_fetch import fetch_dataframe, fetch_exhaustive
+from gsc_store import store
+from gsc_grid import download_csv, results_grid
 from google_auth_oauthlib.flow import Flow
 from apiclient import discovery
 from datetime import datetime, timedelta
@@ -64,19 +67,28 @@ days_map = {"Last 7 days": 7, "Last 28 days": 28, "Last 3 months": 91}
 start_date = datetime.today() - timedelta(days=days_map[date_range])
 end_date = datetime.today()
 
+exhaustive = st.checkbox(
+    "Exhaustive fetch",
+    value=False,
+    help="Split requests by date, device, country (when it is one of the dimensions) and page folder until nothing is truncated by the row cap. Uses more API quota.",
+)
+
 # === Fetch and Limit to Top 100 Pages
 if st.button("📊 Fetch Top Queries"):
     with st.spinner("Fetching top 100 pages with nested queries..."):
         webproperty = account[selected_site]
-        df = (
+        q = (
             webproperty.query.range(str(start_date.date()), str(end_date.date()))
             .dimension("page", "query")
             .search_type("web")
-            .limit(5000)
-            .get()
-            .to_dataframe()
         )
 
+        if exhaustive:
+            df, completeness = fetch_exhaustive(q)
+        else:
+            df = fetch_dataframe(q.limit(5000))
+            completeness = None
+
         if df.empty:
             st.warning("No data returned. Please adjust your filters.")
             st.stop()
@@ -91,8 +103,33 @@ if st.button("📊 Fetch Top Queries"):
         df_filtered = df_filtered[["page", "query", "clicks", "impressions", "position", "ctr"]]
         df_filtered.columns = ["Page", "Query", "Clicks", "Impressions", "Avg Position", "CTR"]
 
-        st.subheader("📄 Top Queries for Top 100 Pages")
-        st.dataframe(df_filtered)
+        if "top_pages_handle" in st.session_state:
+            store.drop(st.session_state["top_pages_handle"])
+        st.session_state["top_pages_handle"] = store.put(df_filtered)
+        st.session_state["top_pages_completeness"] = completeness
+        st.session_state["top_pages_capped"] = completeness is None and len(df) >= 5000
+
+# === Results (kept across reruns so the grid can page, sort and filter)
+if "top_pages_handle" in st.session_state:
+    if store.get(st.session_state["top_pages_handle"]) is None:
+        del st.session_state["top_pages_handle"]
+        st.info("ℹ️ These results have expired from the cache. Please fetch the data again.")
+        st.stop()
 
-        csv = df_filtered.to_csv(index=False)
-        st.download_button("📥 Download CSV", csv, "top_100_pages_queries.csv", "text/csv")
+    st.subheader("📄 Top Queries for Top 100 Pages")
+    completeness = st.session_state["top_pages_completeness"]
+    if completeness:
+        if completeness["complete"]:
+            st.caption(f"✅ Complete: {completeness['rows']:,} rows from {completeness['pieces']} requests.")
+        else:
+            st.warning(
+                f"⚠️ {completeness['truncated_pieces']} of {completeness['pieces']} requests were still truncated "
+                "after splitting; some rows may be missing."
+            )
+        if completeness["clicks_coverage"] is not None:
+            st.caption(f"Rows account for {completeness['clicks_coverage']:.1%} of the property's clicks.")
+    elif st.session_state["top_pages_capped"]:
+        st.warning("⚠️ Hit the 5,000 row limit; results may be truncated. Tick *Exhaustive fetch* to get every row.")
+    results_grid(st.session_state["top_pages_handle"], "top_pages")
+
+    download_csv(st.session_state["top_pages_handle"], "top_100_pages_queries.csv")
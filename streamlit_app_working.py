@@ -1,10 +1,11 @@
 import streamlit as st
-import pandas as pd
 import searchconsole
+from gsc_fetch import fetch_dataframe
+from gsc_store import store
+from gsc_regex import safe_regex_match
 from google_auth_oauthlib.flow import Flow
 from apiclient.discovery import build
 from openai import OpenAI
-import re
 from datetime import date, timedelta
 
 st.set_page_config(page_title="GSC Keyword Extractor", layout="wide")
@@ -16,19 +17,12 @@ if "query_filter_value" not in st.session_state:
     st.session_state["query_filter_value"] = ""
 
 # Helper functions
-def safe_regex_match(series, pattern, invert=False):
-    try:
-        matched = series.str.match(pattern)
-        return ~matched if invert else matched
-    except re.error:
-        return pd.Series([False] * len(series))
-
 def apply_page_filter(df, filter_type, filter_value):
     values = [v.strip() for v in filter_value.split(",") if v.strip()]
     if not values:
         return df
     if filter_type == "contains":
-        return df[df["page"].str.contains('|'.join(values), case=False, na=False)]
+        return df[safe_regex_match(df["page"], '|'.join(values), search=True, case=False)]
     elif filter_type == "starts with":
         return df[df["page"].str.startswith(tuple(values))]
     elif filter_type == "ends with":
@@ -44,7 +38,7 @@ def apply_query_filter(df, filter_type, filter_value):
     if not values:
         return df
     if filter_type == "contains":
-        return df[df["query"].str.contains('|'.join(values), case=False, na=False)]
+        return df[safe_regex_match(df["query"], '|'.join(values), search=True, case=False)]
     elif filter_type == "starts with":
         return df[df["query"].str.startswith(tuple(values))]
     elif filter_type == "ends with":
@@ -134,12 +128,10 @@ if "account" in st.session_state:
                 end_date = date.today()
                 start_date = end_date + timedelta(days=days)
                 
-                df = (
+                df = fetch_dataframe(
                     webproperty.query.range(start_date.isoformat(), end_date.isoformat())
                     .dimension("page", "query")
-                    .get()
-                    .to_dataframe()
-                    )
+                )
                 df = apply_page_filter(df, page_filter_type, page_filter_value)
                 df = apply_query_filter(df, query_filter_type, query_filter_value)
 
@@ -147,7 +139,9 @@ if "account" in st.session_state:
                     st.warning("No data returned. Adjust your filters.")
                     st.stop()
 
-                st.session_state["gsc_data"] = df
+                if "gsc_data_handle" in st.session_state:
+                    store.drop(st.session_state["gsc_data_handle"])
+                st.session_state["gsc_data_handle"] = store.put(df)
                 st.success("✅ Data fetched!")
                 st.dataframe(df.head(50))
                 csv = df.to_csv(index=False)
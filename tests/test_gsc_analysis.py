@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import gsc_analysis
+from gsc_analysis import find_cannibalization
+
+COLUMNS = ["query", "page", "clicks", "impressions", "position"]
+
+
+def sample():
+    return pd.DataFrame(
+        [
+            ("shoes", "/a", 8, 100, 2.0),
+            ("shoes", "/b", 2, 100, 6.0),
+            ("shoes", "/a", 2, 100, 4.0),
+            ("boots", "/c", 5, 50, 1.0),
+            ("hats", "/d", 0, 40, 10.0),
+            ("hats", "/e", 1, 10, 20.0),
+        ],
+        columns=COLUMNS,
+    )
+
+
+def test_shares_spread_and_lost_clicks():
+    conflicts, pages = find_cannibalization(sample())
+
+    # hats: leader /e converts 1/10, so 50 impressions "should" give 5 clicks, not 1.
+    # shoes: leader /a converts 10/200, so 300 impressions "should" give 15, not 12.
+    assert list(conflicts["query"]) == ["hats", "shoes"]
+    assert list(conflicts["leading_page"]) == ["/e", "/a"]
+    assert list(conflicts["lost_clicks"]) == pytest.approx([4.0, 3.0])
+    assert list(conflicts["position_spread"]) == pytest.approx([10.0, 3.0])
+    assert list(conflicts["competing_pages"]) == [2, 2]
+
+    shoes = pages[pages["query"] == "shoes"].set_index("page")
+    assert shoes.loc["/a", "position"] == pytest.approx(3.0)
+    assert shoes.loc["/a", "click_share"] == pytest.approx(10 / 12)
+    assert shoes.loc["/b", "impression_share"] == pytest.approx(1 / 3)
+    hats = pages[pages["query"] == "hats"].set_index("page")
+    assert list(hats["click_share"]) == [1.0, 0.0]
+    assert "boots" not in set(pages["query"])
+
+
+def test_chunks_match_a_single_frame(monkeypatch):
+    monkeypatch.setattr(gsc_analysis, "COMPACT_EVERY", 4)
+    rng = np.random.default_rng(0)
+    n = 400
+    data = pd.DataFrame({
+        "query": [f"q{i}" for i in rng.integers(0, 30, n)],
+        "page": [f"/p{i}" for i in rng.integers(0, 8, n)],
+        "clicks": rng.integers(0, 20, n),
+        "impressions": rng.integers(20, 500, n),
+        "position": rng.uniform(1, 30, n).round(2),
+    })
+    chunks = [data.iloc[start:start + 25] for start in range(0, n, 25)]
+
+    whole = find_cannibalization(data)
+    chunked = find_cannibalization(iter(chunks))
+    for expected, actual in zip(whole, chunked):
+        pd.testing.assert_frame_equal(actual, expected, check_exact=False)
+
+
+def test_min_pages_and_min_impression_share():
+    conflicts, pages = find_cannibalization(sample(), min_impression_share=0.25)
+    # hats' /e has a fifth of the impressions, which leaves hats one page.
+    assert list(conflicts["query"]) == ["shoes"]
+    assert set(pages["page"]) == {"/a", "/b"}
+
+    conflicts, pages = find_cannibalization(sample(), min_pages=3)
+    assert conflicts.empty and pages.empty
+
+
+@pytest.mark.parametrize("data", [pd.DataFrame(columns=COLUMNS), []])
+def test_empty_input(data):
+    conflicts, pages = find_cannibalization(data)
+    assert conflicts.empty and pages.empty
+    assert "lost_clicks" in conflicts and "click_share" in pages
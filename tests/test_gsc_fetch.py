@@ -0,0 +1,452 @@
+import email
+import json
+
+import googleapiclient.discovery
+import googleapiclient.http
+import httplib2
+import pytest
+import searchconsole
+
+import gsc_fetch
+
+
+class HttpError(Exception):
+    pass
+
+
+class FakeRequest:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self, http=None, num_retries=0):
+        self.service.single_calls.append(self.body)
+        return self.service.respond(self.body, batched=False)
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.batches.append([request.body for _, request in self.requests])
+        if self.service.reject_batches:
+            raise HttpError("batch endpoint rejected the request")
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, self.service.respond(request.body, batched=True), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class FakeService:
+    """Serves `total` rows per device filter, failing where asked to."""
+
+    def __init__(self, total=7, fail_in_batch=(), fail_always=(), reject_batches=False):
+        self.total = total
+        self.fail_in_batch = set(fail_in_batch)
+        self.fail_always = set(fail_always)
+        self.reject_batches = reject_batches
+        self.batches = []
+        self.single_calls = []
+
+    def searchanalytics(self):
+        return self
+
+    def query(self, siteUrl, body):
+        return FakeRequest(self, body)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def respond(self, body, batched):
+        device = body["dimensionFilterGroups"][0]["filters"][0]["expression"]
+        if device in self.fail_always or (batched and device in self.fail_in_batch):
+            raise HttpError(f"backend error for {device}")
+        start, limit = body["startRow"], body["rowLimit"]
+        rows = [
+            {"keys": [f"{device}-q{i}"], "clicks": i, "impressions": 2 * i, "ctr": 0.5, "position": 1.0}
+            for i in range(start, min(self.total, start + limit))
+        ]
+        return {"rows": rows} if rows else {}
+
+
+def body(device):
+    return {
+        "startDate": "2024-01-01",
+        "endDate": "2024-01-07",
+        "dimensions": ["query"],
+        "dimensionFilterGroups": [{"filters": [{"dimension": "device", "expression": device}]}],
+    }
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    monkeypatch.setattr(gsc_fetch, "ROW_LIMIT", 3)
+
+
+def test_pages_every_body_through_batches():
+    service = FakeService(total=7)
+    rows = gsc_fetch.execute_batched(service, "sc-domain:x", [body("DESKTOP"), body("MOBILE")])
+
+    assert [len(r) for r in rows] == [7, 7]
+    assert [row["keys"][0] for row in rows[1]] == [f"MOBILE-q{i}" for i in range(7)]
+    assert len(service.batches) == 3
+    assert service.single_calls == []
+
+
+def test_caps_rows_per_body():
+    service = FakeService(total=7)
+    rows = gsc_fetch.execute_batched(service, "sc-domain:x", [body("DESKTOP"), body("MOBILE")], caps=[5, None])
+
+    assert [len(r) for r in rows] == [5, 7]
+    # The capped body asks only for the rows it still needs.
+    assert [b["rowLimit"] for b in service.batches[1] if "DESKTOP" in str(b)] == [2]
+
+
+def test_retries_a_call_that_fails_inside_a_batch():
+    service = FakeService(total=2, fail_in_batch={"MOBILE"})
+    rows = gsc_fetch.execute_batched(service, "sc-domain:x", [body("DESKTOP"), body("MOBILE"), body("TABLET")])
+
+    assert [len(r) for r in rows] == [2, 2, 2]
+    assert [b["dimensionFilterGroups"][0]["filters"][0]["expression"] for b in service.single_calls] == ["MOBILE"]
+
+
+def test_falls_back_to_single_calls_when_the_batch_is_rejected():
+    service = FakeService(total=2, reject_batches=True)
+    rows = gsc_fetch.execute_batched(service, "sc-domain:x", [body("DESKTOP"), body("MOBILE")])
+
+    assert [len(r) for r in rows] == [2, 2]
+    assert len(service.single_calls) == 2
+
+
+def test_raises_when_the_single_retry_fails_too():
+    service = FakeService(fail_always={"MOBILE"})
+    with pytest.raises(HttpError):
+        gsc_fetch.execute_batched(service, "sc-domain:x", [body("DESKTOP"), body("MOBILE")])
+
+
+def test_rows_to_dataframe_names_dimensions_and_metrics():
+    rows = [{"keys": ["/a", "shoes"], "clicks": 3, "impressions": 10, "ctr": 0.3, "position": 2.0}]
+    df = gsc_fetch.rows_to_dataframe(rows, ["page", "query"])
+
+    assert list(df.columns) == ["page", "query", "clicks", "impressions", "ctr", "position"]
+    assert list(gsc_fetch.rows_to_dataframe([], ["page"], "googleNews").columns) == ["page", "clicks", "impressions", "ctr"]
+
+
+class FakeProperty:
+    """Just enough of searchconsole's Account/WebProperty/Query for the fetch helpers."""
+
+    def __init__(self, service, permission="siteOwner"):
+        self.url = "sc-domain:x"
+        self.permission = permission
+        self.account = type("Account", (), {"service": service, "credentials": None})()
+
+
+class FakeQuery:
+    def __init__(self, service, dimensions, start="2024-01-01", end="2024-01-04", permission="siteOwner"):
+        self.api = FakeProperty(service, permission)
+        self.raw = {"startDate": start, "endDate": end, "dimensions": list(dimensions), "startRow": 0, "rowLimit": 25000}
+        self.meta = {}
+
+    def build(self):
+        return dict(self.raw)
+
+    def range(self, start, end):
+        query = FakeQuery(self.api.account.service, self.raw["dimensions"], start, end, self.api.permission)
+        query.meta = dict(self.meta)
+        return query
+
+    def limit(self, maximum):
+        query = self.range(self.raw["startDate"], self.raw["endDate"])
+        query.meta["limit"] = maximum
+        return query
+
+    def get(self):
+        rows = gsc_fetch.execute_batched(self.api.account.service, self.api.url, [self.build()], [self.meta.get("limit")])[0]
+        report = type("Report", (), {})()
+        report.to_dataframe = lambda: gsc_fetch.rows_to_dataframe(rows, self.raw["dimensions"])
+        return report
+
+
+class SiteService(FakeService):
+    """Filters a day x device x query table by date range and device like the API."""
+
+    def __init__(self, queries_per_slice=2):
+        super().__init__()
+        self.table = [
+            (f"2024-01-0{day}", device, f"q{day}-{n}", 1 + n)
+            for day in range(1, 5)
+            for device in gsc_fetch.DEVICES
+            for n in range(queries_per_slice)
+        ]
+
+    def respond(self, body, batched):
+        devices = [
+            f["expression"]
+            for group in body.get("dimensionFilterGroups", [])
+            for f in group["filters"]
+            if f["dimension"] == "device"
+        ]
+        totals = {}
+        for day, device, query, clicks in self.table:
+            if body["startDate"] <= day <= body["endDate"] and all(device == d for d in devices):
+                key = (query,) if body.get("dimensions") else ()
+                totals[key] = totals.get(key, 0) + clicks
+        rows = [
+            {"keys": list(key), "clicks": clicks, "impressions": 10 * clicks, "ctr": 0.1, "position": 3.0}
+            for key, clicks in sorted(totals.items(), key=lambda item: -item[1])
+        ]
+        rows = rows[body["startRow"]:body["startRow"] + body["rowLimit"]]
+        return {"rows": rows} if rows else {}
+
+
+def test_exhaustive_fetch_splits_until_complete():
+    gsc_fetch.clear_recent()
+    service = SiteService()
+    df, completeness = gsc_fetch.fetch_exhaustive(FakeQuery(service, ["query"]), piece_cap=3)
+
+    assert completeness["complete"]
+    assert completeness["pieces"] == 7
+    assert completeness["clicks_coverage"] == pytest.approx(1.0)
+    assert len(df) == 8
+    assert df["clicks"].sum() == sum(clicks for *_, clicks in service.table)
+
+
+@pytest.mark.parametrize("max_pieces", [1, 3, 5])
+def test_exhaustive_fetch_keeps_truncated_rows_when_the_budget_runs_out(monkeypatch, max_pieces):
+    gsc_fetch.clear_recent()
+    monkeypatch.setattr(gsc_fetch, "MAX_PIECES", max_pieces)
+    df, completeness = gsc_fetch.fetch_exhaustive(FakeQuery(SiteService(), ["query"]), piece_cap=3)
+
+    assert not completeness["complete"]
+    assert completeness["truncated_pieces"] > 0
+    assert len(df) > 0
+    assert list(df.columns) == ["query", "clicks", "impressions", "ctr", "position"]
+
+
+def test_followers_get_the_result_even_if_caching_it_fails(monkeypatch):
+    import threading
+
+    gsc_fetch.clear_recent()
+    release = threading.Event()
+    results = []
+
+    def failing_put(df):
+        raise OSError(28, "No space left on device")
+
+    def slow_fetch():
+        release.wait(5)
+        return gsc_fetch.rows_to_dataframe([], ["query"])
+
+    monkeypatch.setattr(gsc_fetch.store, "put", failing_put)
+    threads = [
+        threading.Thread(target=lambda: results.append(gsc_fetch._single_flight("key", slow_fetch)), daemon=True)
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(3)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(results) == 3
+    assert gsc_fetch._inflight == {}
+
+
+def test_progressive_fetch_streams_totals_and_shares_one_full_pull():
+    gsc_fetch.clear_recent()
+    service = SiteService()
+    only_busy_queries = lambda frame: frame[frame["clicks"] > 3]
+
+    leader = gsc_fetch.fetch_progressive(FakeQuery(service, ["query"]), transform=only_busy_queries, preview_days=1)
+    head, totals, stage = next(leader)
+    assert stage == "preview"
+    assert list(head["query"]) == ["q4-1"]
+
+    follower = list(gsc_fetch.fetch_progressive(FakeQuery(service, ["query"]), preview_days=1))
+    stages = list(leader)
+
+    partial = [totals for _, totals, stage in stages if stage == "partial"]
+    assert partial[-1] == {"clicks": 24, "impressions": 240, "rows": 4}
+    final, _, stage = stages[-1]
+    assert stage == "final" and len(final) == 8
+    assert follower[-1][2] == "final" and len(follower[-1][0]) == 8
+    full_range_calls = [b for b in service.single_calls if b["startDate"] == "2024-01-01"]
+    assert len(full_range_calls) == 4
+
+
+class ForbiddenService(FakeService):
+    """What the API does for a property the user added but never verified."""
+
+    def respond(self, body, batched):
+        raise HttpError("403 User does not have sufficient permission for site")
+
+
+def test_unverified_properties_are_never_served_shared_results():
+    gsc_fetch.clear_recent()
+    owner = FakeQuery(SiteService(), ["query"])
+    gsc_fetch.fetch_dataframe(owner)
+    gsc_fetch.fetch_exhaustive(owner, piece_cap=3)
+
+    intruder = FakeQuery(ForbiddenService(), ["query"], permission="siteUnverifiedUser")
+    with pytest.raises(HttpError):
+        gsc_fetch.fetch_dataframe(intruder)
+    with pytest.raises(HttpError):
+        gsc_fetch.fetch_exhaustive(intruder, piece_cap=3)
+    with pytest.raises(HttpError):
+        gsc_fetch.fetch_many([intruder])
+    with pytest.raises(HttpError):
+        list(gsc_fetch.fetch_progressive(intruder))
+    assert gsc_fetch._inflight == {}
+
+
+def test_unverified_callers_fetch_privately():
+    gsc_fetch.clear_recent()
+    service = SiteService()
+    query = FakeQuery(service, ["query"], permission="siteUnverifiedUser")
+
+    assert len(gsc_fetch.fetch_dataframe(query)) == 8
+    final, _, stage = list(gsc_fetch.fetch_progressive(query, preview_days=1))[-1]
+    assert stage == "final" and len(final) == 8
+    assert gsc_fetch._recent == {} and gsc_fetch._inflight == {} and gsc_fetch._feeds == {}
+
+
+# --- The same paths through googleapiclient's real service and BatchHttpRequest,
+# against an in-process endpoint that speaks the batch (multipart/mixed) wire format.
+
+class FakeEndpoint:
+    """Stands in for httplib2.Http. Serves `total` query rows per device; a
+    device listed in `throttled_in_batch` gets 429s inside batches, and one in
+    `flaky` fails with 503 that many times when called on its own."""
+
+    def __init__(self, total=5, throttled_in_batch=(), flaky=None, reject_batches=False):
+        self.total = total
+        self.throttled_in_batch = set(throttled_in_batch)
+        self.flaky = dict(flaky or {})
+        self.reject_batches = reject_batches
+        self.batches = []
+        self.single_calls = []
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        if uri.endswith("/batch/webmasters/v3"):
+            return self._batch(body, headers)
+        query = json.loads(body)
+        self.single_calls.append(query)
+        device = self._device(query)
+        if self.flaky.get(device):
+            self.flaky[device] -= 1
+            return self._response(503, {"error": {"code": 503, "message": "Backend Error"}})
+        return self._response(200, self._rows(query))
+
+    def _batch(self, body, headers):
+        if self.reject_batches:
+            return self._response(500, {"error": {"code": 500, "message": "Internal Error"}})
+        message = email.message_from_string("content-type: %s\r\n\r\n%s" % (headers["content-type"], body))
+        parts, queries = [], []
+        for part in message.get_payload():
+            query = json.loads(part.get_payload().split("\n\n", 1)[1])
+            queries.append(query)
+            if self._device(query) in self.throttled_in_batch:
+                status, reply = "429 Too Many Requests", {"error": {"code": 429, "message": "Quota exceeded"}}
+            else:
+                status, reply = "200 OK", self._rows(query)
+            parts.append(
+                "--BOUNDARY\r\nContent-Type: application/http\r\nContent-ID: <response-%s>\r\n\r\n"
+                "HTTP/1.1 %s\r\nContent-Type: application/json\r\n\r\n%s\r\n"
+                % (part["Content-ID"][1:-1], status, json.dumps(reply))
+            )
+        self.batches.append(queries)
+        content = "".join(parts) + "--BOUNDARY--"
+        return httplib2.Response({"status": "200", "content-type": "multipart/mixed; boundary=BOUNDARY"}), content.encode()
+
+    @staticmethod
+    def _device(query):
+        return query["dimensionFilterGroups"][0]["filters"][0]["expression"]
+
+    def _rows(self, query):
+        device, start, limit = self._device(query), query["startRow"], query["rowLimit"]
+        rows = [
+            {"keys": [f"{device}-q{i}"], "clicks": i, "impressions": 2 * i, "ctr": 0.5, "position": 1.0}
+            for i in range(start, min(self.total, start + limit))
+        ]
+        return {"rows": rows} if rows else {}
+
+    @staticmethod
+    def _response(status, payload):
+        return httplib2.Response({"status": str(status), "content-type": "application/json"}), json.dumps(payload).encode()
+
+
+@pytest.fixture
+def no_backoff_sleep(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(googleapiclient.http.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def webproperty(endpoint, permission="siteOwner"):
+    service = googleapiclient.discovery.build("webmasters", "v3", http=endpoint, static_discovery=True)
+    account = searchconsole.account.Account(service, None)
+    return searchconsole.account.WebProperty({"siteUrl": "sc-domain:x", "permissionLevel": permission}, account)
+
+
+def device_query(prop, device):
+    return prop.query.range("2024-01-01", "2024-01-07").dimension("query").filter("device", device)
+
+
+def test_batched_fan_out_through_the_client_library():
+    endpoint = FakeEndpoint(total=5)
+    service = webproperty(endpoint).account.service
+    rows = gsc_fetch.execute_batched(service, "sc-domain:x", [body(d) for d in gsc_fetch.DEVICES])
+
+    assert [len(r) for r in rows] == [5, 5, 5]
+    assert [row["keys"][0] for row in rows[2]] == [f"TABLET-q{i}" for i in range(5)]
+    assert [len(batch) for batch in endpoint.batches] == [3, 3]
+    assert endpoint.single_calls == []
+
+
+def test_throttled_sub_request_is_retried_with_backoff(no_backoff_sleep):
+    endpoint = FakeEndpoint(total=2, throttled_in_batch={"MOBILE"}, flaky={"MOBILE": 2})
+    service = webproperty(endpoint).account.service
+    rows = gsc_fetch.execute_batched(service, "sc-domain:x", [body(d) for d in gsc_fetch.DEVICES])
+
+    assert [len(r) for r in rows] == [2, 2, 2]
+    assert [FakeEndpoint._device(q) for q in endpoint.single_calls] == ["MOBILE"] * 3
+    assert len(no_backoff_sleep) == 2
+
+
+def test_rejected_batch_through_the_client_library(no_backoff_sleep):
+    endpoint = FakeEndpoint(total=2, reject_batches=True)
+    service = webproperty(endpoint).account.service
+    rows = gsc_fetch.execute_batched(service, "sc-domain:x", [body("DESKTOP"), body("MOBILE")])
+
+    assert [len(r) for r in rows] == [2, 2]
+    assert len(endpoint.single_calls) == 2
+
+
+def test_fetch_many_splits_results_per_query_and_reuses_the_cache():
+    gsc_fetch.clear_recent()
+    endpoint = FakeEndpoint(total=4)
+    prop = webproperty(endpoint)
+
+    first = gsc_fetch.fetch_many([device_query(prop, "DESKTOP"), device_query(prop, "MOBILE").limit(3)])
+    assert [list(df["query"]) for df in first] == [
+        [f"DESKTOP-q{i}" for i in range(4)],
+        [f"MOBILE-q{i}" for i in range(3)],
+    ]
+    # Both first pages share a batch; the capped query is then done.
+    assert len(endpoint.batches) == 1
+    assert [FakeEndpoint._device(q) for q in endpoint.single_calls] == ["DESKTOP"]
+
+    second = gsc_fetch.fetch_many([device_query(prop, "MOBILE").limit(3), device_query(prop, "TABLET")])
+    assert list(second[0]["query"]) == list(first[1]["query"])
+    assert list(second[1]["query"]) == [f"TABLET-q{i}" for i in range(4)]
+    # Only the uncached query went out, on its own.
+    assert len(endpoint.batches) == 1
+    assert [FakeEndpoint._device(q) for q in endpoint.single_calls] == ["DESKTOP", "TABLET", "TABLET"]
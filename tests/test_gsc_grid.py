@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import gsc_grid
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    gsc_grid._cache.clear()
+    yield
+    gsc_grid._cache.clear()
+
+
+def frame():
+    return pd.DataFrame({
+        "page": ["/Blog/a", None, "/shop/b", "/blog/c", "/about"],
+        "clicks": [3.0, np.nan, 5.0, 1.0, np.nan],
+    })
+
+
+@pytest.mark.parametrize("ascending, expected", [(True, [3, 0, 2, 1, 4]), (False, [2, 0, 3, 1, 4])])
+def test_sort_puts_missing_values_last(ascending, expected):
+    assert list(gsc_grid._sort_order(frame(), "h", "clicks", ascending)) == expected
+
+
+def test_filter_is_case_insensitive_and_skips_missing_values():
+    mask = gsc_grid._filter_mask(frame(), "h", "page", "BLOG")
+    assert mask.tolist() == [True, False, False, True, False]
+
+
+def test_filter_applies_on_top_of_the_sort_order():
+    positions = gsc_grid._view(frame(), "h", "clicks", False, "page", "blog")
+    assert list(positions) == [0, 3]
+    assert list(gsc_grid._view(frame(), "h", None, True, None, "")) == [0, 1, 2, 3, 4]
+
+
+def test_cached_views_are_kept_per_dataset():
+    first = frame()
+    second = frame().assign(clicks=[1.0, 2.0, 3.0, 4.0, 5.0])
+
+    assert list(gsc_grid._view(first, "first", "clicks", True, None, "")) == [3, 0, 2, 1, 4]
+    assert list(gsc_grid._view(second, "second", "clicks", True, None, "")) == [0, 1, 2, 3, 4]
+    # Same dataset key: the cached order is reused rather than recomputed.
+    assert list(gsc_grid._view(second, "first", "clicks", True, None, "")) == [3, 0, 2, 1, 4]
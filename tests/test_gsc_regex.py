@@ -0,0 +1,52 @@
+import time
+
+import pandas as pd
+import pytest
+
+import gsc_regex
+from gsc_regex import RegexTimeout, regex_mask, safe_regex_match
+
+
+def test_nested_quantifiers_run_in_linear_time_on_re2():
+    if gsc_regex.re2 is None:
+        pytest.skip("google-re2 not installed")
+    values = pd.Series(["a" * 40 + "b", "aaa"])
+    started = time.monotonic()
+    mask = regex_mask(values, r"(a+)+$")
+    assert time.monotonic() - started < 1
+    assert list(mask) == [False, True]
+
+
+def test_backtracking_pattern_times_out_to_an_empty_mask():
+    values = pd.Series(["a" * 40 + "b"] * 3, index=[10, 20, 30])
+    with pytest.raises(RegexTimeout):
+        regex_mask(values, r"(a+)+\1$", budget=0.5)
+
+    started = time.monotonic()
+    mask = safe_regex_match(values, r"(a+)+\1$")
+    assert time.monotonic() - started < gsc_regex.TIME_BUDGET_SECONDS + 2
+    assert list(mask.index) == [10, 20, 30]
+    assert not mask.any()
+
+
+def test_invert_missing_values_and_index():
+    values = pd.Series(["/blog/a", None, "/shop/b", float("nan"), "/Blog/c"], index=list("vwxyz"))
+
+    assert list(safe_regex_match(values, "/blog")) == [True, False, False, False, False]
+    assert list(safe_regex_match(values, "blog", search=True, case=False)) == [True, False, False, False, True]
+    inverted = safe_regex_match(values, "/blog", invert=True)
+    assert list(inverted) == [False, True, True, True, True]
+    assert list(inverted.index) == list("vwxyz")
+
+
+def test_backreferences_fall_back_to_python_re():
+    values = pd.Series(["abab", "abcd"])
+    assert list(regex_mask(values, r"(ab)\1")) == [True, False]
+
+
+def test_invalid_pattern_matches_nothing():
+    values = pd.Series(["/a", "/b"], index=[5, 6])
+    with pytest.raises(gsc_regex.re.error):
+        regex_mask(values, "(")
+    mask = safe_regex_match(values, "(")
+    assert list(mask.index) == [5, 6] and not mask.any()
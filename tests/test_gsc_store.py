@@ -0,0 +1,86 @@
+import os
+
+import pandas as pd
+
+from gsc_store import DatasetStore
+
+
+def frame(n):
+    return pd.DataFrame({"page": [f"/p{n}/{i}" for i in range(50)], "clicks": range(50)})
+
+
+def test_spills_least_recently_used_datasets_and_reloads_them(tmp_path):
+    data = frame(0)
+    store = DatasetStore(memory_budget=int(data.memory_usage(deep=True).sum()) * 2, spill_dir=str(tmp_path))
+    handles = [store.put(frame(n)) for n in range(4)]
+
+    assert len(os.listdir(tmp_path)) == 2
+    reloaded = store.get(handles[0])
+    assert list(reloaded["page"]) == list(frame(0)["page"])
+    assert reloaded["clicks"].sum() == frame(0)["clicks"].sum()
+
+
+def test_keeps_a_dataset_in_memory_when_spilling_fails(tmp_path, monkeypatch):
+    store = DatasetStore(memory_budget=1, spill_dir=str(tmp_path))
+
+    def failing_spill(handle, df):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(store, "_spill", failing_spill)
+    handle = store.put(frame(0))
+
+    assert store.get(handle) is not None
+    assert os.listdir(tmp_path) == []
+
+
+def test_drop_removes_spill_files_and_evicts_over_the_disk_budget(tmp_path):
+    store = DatasetStore(memory_budget=1, spill_dir=str(tmp_path))
+    first = store.put(frame(0))
+    store.disk_budget = os.path.getsize(tmp_path / os.listdir(tmp_path)[0]) * 3 // 2
+    second = store.put(frame(1))
+
+    assert store.get(first) is None
+    assert store.get(second) is not None
+    store.drop(second)
+    assert store.get(second) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_shallow_copies_share_one_dataset(tmp_path):
+    store = DatasetStore(spill_dir=str(tmp_path))
+    data = frame(0).astype({"page": "string[pyarrow]"})
+    first = store.put(data)
+    size = store.memory_usage()
+    second = store.put(data.copy(deep=False))
+
+    assert store.memory_usage() == size
+    store.drop(first)
+    assert store.get(second) is not None
+    assert store.memory_usage() == size
+    store.drop(second)
+    assert store.memory_usage() == 0
+
+
+def test_derived_frames_are_stored_separately(tmp_path):
+    store = DatasetStore(spill_dir=str(tmp_path))
+    data = frame(0)
+    store.put(data)
+    size = store.memory_usage()
+    subset = store.put(data[data["clicks"] > 10])
+    store.put(data.head(10))
+
+    assert store.memory_usage() > size
+    assert len(store.get(subset)) == 39
+
+
+def test_shared_dataset_spills_once_and_survives_until_the_last_drop(tmp_path):
+    data = frame(0)
+    store = DatasetStore(memory_budget=int(data.memory_usage(deep=True).sum()), spill_dir=str(tmp_path))
+    handles = [store.put(data), store.put(data.copy(deep=False))]
+    store.put(frame(1))
+
+    assert len(os.listdir(tmp_path)) == 1
+    store.drop(handles[0])
+    assert list(store.get(handles[1])["page"]) == list(data["page"])
+    store.drop(handles[1])
+    assert os.listdir(tmp_path) == []